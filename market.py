@@ -1,16 +1,46 @@
+import asyncio
 import datetime
 import logging.config
 from environs import Env
 from seller import download_stock
 
-import requests
-
-from seller import divide, price_conversion
+import httpx
+import orjson
+
+from seller import (
+    API_TIMEOUT,
+    ZEROED_OFFERS_DIR,
+    ConcurrencyController,
+    ObservedTransport,
+    load_zeroed_offers,
+    prepare_remnants,
+    retry_with_backoff,
+    save_zeroed_offers,
+    update_in_chunks,
+)
 
 logger = logging.getLogger(__file__)
 
+_CONTROLLER = ConcurrencyController()
+
+_CLIENT = httpx.AsyncClient(
+    base_url="https://api.partner.market.yandex.ru/",
+    transport=ObservedTransport(
+        _CONTROLLER,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+    ),
+    timeout=API_TIMEOUT,
+    headers={
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+    },
+    event_hooks={"request": [_CONTROLLER.on_request], "response": [_CONTROLLER.observe]},
+)
 
-def get_product_list(page, campaign_id, access_token):
+
+@retry_with_backoff(base=0.5, cap=30, max_attempts=7)
+async def get_product_list(page, campaign_id, access_token):
     """
     Получает список всех товаров магазина на Яндекс Маркете.
 
@@ -28,7 +58,7 @@ def get_product_list(page, campaign_id, access_token):
 
     Examples:
         correct execution:
-            >>> print(get_product_list("", 123456, "y0_BfRRRRRV2L8sWWvNkSNNNNSrLHaNXg4cCMswFbL6MWab9lktL2KPsMw"))
+            >>> print(asyncio.run(get_product_list("", 123456, "y0_BfRRRRRV2L8sWWvNkSNNNNSrLHaNXg4cCMswFbL6MWab9lktL2KPsMw")))
             {
                 "paging": {"nextPageToken": "eyBuZXh0SWQ6IDIzNDIgfQ==", "prevPageToken": ""},
                 "offerMappingEntries": [
@@ -49,28 +79,23 @@ def get_product_list(page, campaign_id, access_token):
             }
 
         incorrect execution:
-            >>> print(get_product_list("", 123456, ""))
-            requests.exceptions.HTTPError: 401 Client Error
+            >>> print(asyncio.run(get_product_list("", 123456, "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = {"Authorization": f"Bearer {access_token}"}
     payload = {
         "page_token": page,
         "limit": 200,
     }
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-mapping-entries"
-    response = requests.get(url, headers=headers, params=payload)
+    url = f"campaigns/{campaign_id}/offer-mapping-entries"
+    response = await _CLIENT.get(url, headers=headers, params=payload)
     response.raise_for_status()
-    response_object = response.json()
+    response_object = orjson.loads(response.content)
     return response_object.get("result")
 
 
-def update_stocks(stocks, campaign_id, access_token):
+@retry_with_backoff(base=0.5, cap=30, max_attempts=7)
+async def update_stocks(stocks, campaign_id, access_token):
     """
     Обновляет остатки товаров магазина на Яндекс Маркете.
 
@@ -84,29 +109,24 @@ def update_stocks(stocks, campaign_id, access_token):
 
     Examples:
         correct execution:
-            >>> print(update_stocks([{'id': '69791', 'price': {'value': 550, 'currencyId': 'RUR'}}], 123456, "y0_BfRRRRRV2L8sWWvNkSNNNNSrLHaNXg4cCMswFbL6MWab9lktL2KPsMw"))
+            >>> print(asyncio.run(update_stocks([{'id': '69791', 'price': {'value': 550, 'currencyId': 'RUR'}}], 123456, "y0_BfRRRRRV2L8sWWvNkSNNNNSrLHaNXg4cCMswFbL6MWab9lktL2KPsMw")))
             {"status": "OK"}
 
         incorrect execution:
-            >>> print(update_stocks([], "123456", ""))
-            requests.exceptions.HTTPError: 401 Client Error
+            >>> print(asyncio.run(update_stocks([], "123456", "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = {"Authorization": f"Bearer {access_token}"}
     payload = {"skus": stocks}
-    url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
+    url = f"campaigns/{campaign_id}/offers/stocks"
+    response = await _CLIENT.put(url, headers=headers, content=orjson.dumps(payload))
     response.raise_for_status()
-    response_object = response.json()
+    response_object = orjson.loads(response.content)
     return response_object
 
 
-def update_price(prices, campaign_id, access_token):
+@retry_with_backoff(base=0.5, cap=30, max_attempts=7)
+async def update_price(prices, campaign_id, access_token):
     """
     Обновляет цены товаров магазина на Яндекс Маркете.
 
@@ -120,29 +140,23 @@ def update_price(prices, campaign_id, access_token):
 
     Examples:
         correct execution:
-            >>> print(update_price([{'id': '69791', 'price': {'value': 550, 'currencyId': 'RUR'}}], 123456, "y0_BfRRRRRV2L8sWWvNkSNNNNSrLHaNXg4cCMswFbL6MWab9lktL2KPsMw"))
+            >>> print(asyncio.run(update_price([{'id': '69791', 'price': {'value': 550, 'currencyId': 'RUR'}}], 123456, "y0_BfRRRRRV2L8sWWvNkSNNNNSrLHaNXg4cCMswFbL6MWab9lktL2KPsMw")))
             {"status": "OK"}
 
         incorrect execution:
-            >>> print(update_price([], "123456", ""))
-            requests.exceptions.HTTPError: 401 Client Error
+            >>> print(asyncio.run(update_price([], "123456", "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = {"Authorization": f"Bearer {access_token}"}
     payload = {"offers": prices}
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
+    url = f"campaigns/{campaign_id}/offer-prices/updates"
+    response = await _CLIENT.post(url, headers=headers, content=orjson.dumps(payload))
     response.raise_for_status()
-    response_object = response.json()
+    response_object = orjson.loads(response.content)
     return response_object
 
 
-def get_offer_ids(campaign_id, market_token):
+async def get_offer_ids(campaign_id, market_token):
     """
     Получает артикулы всех товаров магазина на Яндекс Маркете.
 
@@ -155,84 +169,82 @@ def get_offer_ids(campaign_id, market_token):
     
     Examples:
         correct execution:
-            >>> print(get_offer_ids("123456", "y0_BfRRRRRV2L8sWWvNkSNNNNSrLHaNXg4cCMswFbL6MWab9lktL2KPsMw"))
+            >>> print(asyncio.run(get_offer_ids("123456", "y0_BfRRRRRV2L8sWWvNkSNNNNSrLHaNXg4cCMswFbL6MWab9lktL2KPsMw")))
             ['136748', '136749']
 
         incorrect execution:
-            >>> print(get_offer_ids("123456", ""))
-            requests.exceptions.HTTPError: 401 Client Error
+            >>> print(asyncio.run(get_offer_ids("123456", "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
     """
     page = ""
-    product_list = []
+    offer_ids = []
     while True:
-        some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
+        some_prod = await get_product_list(page, campaign_id, market_token)
+        offer_ids.extend(
+            product.get("offer").get("shopSku")
+            for product in some_prod.get("offerMappingEntries")
+        )
         page = some_prod.get("paging").get("nextPageToken")
         if not page:
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer").get("shopSku"))
     return offer_ids
 
 
-def create_stocks(watch_remnants, offer_ids, warehouse_id):
+def create_stocks(watch_remnants, offer_ids, warehouse_id, zeroed=frozenset()):
     """
     Формирует список всех товаров магазина на Яндекс Маркете с новыми значениями количества, а именно:
     если товар с сайта timeworld.ru есть в магазине на Яндекс Маркете, то количество записывается по условиям:
         если на сайте = ">10", то = 100,
         если на сайте = "1", то = 0,
         иначе, то = количество с сайта.
-    Для товаров магазина на Яндекс Маркете, которых нет на сайте timeworld.ru, записывается количество = 0.
+    Для товаров магазина на Яндекс Маркете, которых нет на сайте timeworld.ru, записывается количество = 0,
+    кроме тех, кому оно уже было записано (zeroed). Расчет на то, что Яндекс Маркет не меняет остатки товаров,
+    которых нет в запросе; на случай ручных правок все нули повторяются раз в ZEROED_OFFERS_TTL.
 
     Args:
-        watch_remnants (list of dict): Список остатков товаров с сайта timeworld.ru.
-        offer_ids (list): Список артикулов товаров магазина на Яндекс Маркете.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru, подготовленная prepare_remnants.
+        offer_ids (list): Список артикулов товаров магазина на Яндекс Маркете, сам список не изменяется.
         warehouse_id (int): Идентификатор склада на Яндекс маркете.
+        zeroed (set): Артикулы, которым количество = 0 уже записано при прошлом обновлении.
 
     Returns:
         list of dict: Список товаров с данными о количестве.
     
     Examples:
         correct execution:
-            >>> print(create_stocks([{'Код': 69791, 'Количество': '>10'}], ['69791', '70000']), 1)
+            >>> print(create_stocks(prepare_remnants(pd.DataFrame([{'Код': 69791, 'Количество': '>10', 'Цена': '550.00 руб.'}])), ['69791', '70000'], 1))
             [
                 {'sku': '69791', 'warehouseId': 1, 'items': [{'count': 100, 'type': 'FIT', 'updatedAt': '2025-12-14T16:30:31Z'}]}, 
                 {'sku': '70000', 'warehouseId': 1, 'items': [{'count': 0, 'type': 'FIT', 'updatedAt': '2025-12-14T16:30:31Z'}]}
             ]
 
         incorrect execution:
-            >>> print(create_stocks([{'Код': 69791, 'Количество': '>10'}], ['69791', '70000']))
+            >>> print(create_stocks(prepare_remnants(pd.DataFrame([{'Код': 69791, 'Количество': '>10', 'Цена': '550.00 руб.'}])), ['69791', '70000']))
             TypeError: create_stocks1() missing 1 required positional argument: 'warehouse_id'
     """
     # Уберем то, что не загружено в market
-    stocks = list()
-    date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
+    # Одна строка с датой на все товары
+    date = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+    remnants = watch_remnants[watch_remnants["Код"].isin(offer_ids)].drop_duplicates("Код")
+    stocks = [
+        {
+            "sku": code,
+            "warehouseId": warehouse_id,
+            "items": [
                 {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
+                    "count": stock,
+                    "type": "FIT",
+                    "updatedAt": date,
                 }
-            )
-            offer_ids.remove(str(watch.get("Код")))
-    # Добавим недостающее из загруженного:
+            ],
+        }
+        for code, stock in zip(remnants["Код"].tolist(), remnants["stock"].tolist())
+    ]
+    # Добавим недостающее из загруженного, сохраняя порядок offer_ids:
+    skipped = set(remnants["Код"]).union(zeroed)
     for offer_id in offer_ids:
+        if offer_id in skipped:
+            continue
         stocks.append(
             {
                 "sku": offer_id,
@@ -252,121 +264,143 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
 def create_prices(watch_remnants, offer_ids):
     """
     Формирует список товаров магазина на Яндекс Маркете, которые есть на сайте timeworld.ru, с новыми значениями цен.
+    Товары, в цене которых на сайте нет цифр, пропускаются.
 
     Args:
-        watch_remnants (list of dict): Список остатков товаров с сайта timeworld.ru.
-        offer_ids (list): Список артикулов товаров магазина на Яндекс Маркете.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru, подготовленная prepare_remnants.
+        offer_ids (list): Список артикулов товаров магазина на Яндекс Маркете, сам список не изменяется.
 
     Returns:
         list of dict: Список товаров с данными о цене.
     
     Examples:
         correct execution:
-            >>> print(create_prices([{'Код': 69791, 'Цена': '550.00 руб.'}], ['69791', '70000']))
+            >>> print(create_prices(prepare_remnants(pd.DataFrame([{'Код': 69791, 'Количество': '>10', 'Цена': '550.00 руб.'}])), ['69791', '70000']))
             [{'id': '69791', 'price': {'value': 550, 'currencyId': 'RUR'}}]
 
         incorrect execution:
             >>> print(create_prices({'Код': 69791, 'Количество': '>10'}, ['69791', '70000']))
-            AttributeError: 'str' object has no attribute 'get'
+            AttributeError: 'int' object has no attribute 'isin'
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                # "feed": {"id": 0},
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    # "discountBase": 0,
-                    "currencyId": "RUR",
-                    # "vat": 0,
-                },
-                # "marketSku": 0,
-                # "shopSku": "string",
-            }
-            prices.append(price)
-    return prices
-
-
-async def upload_prices(watch_remnants, campaign_id, market_token):
+    remnants = watch_remnants[watch_remnants["Код"].isin(offer_ids) & watch_remnants["price_int"].notna()]
+    return [
+        {
+            "id": code,
+            # "feed": {"id": 0},
+            "price": {
+                "value": value,
+                # "discountBase": 0,
+                "currencyId": "RUR",
+                # "vat": 0,
+            },
+            # "marketSku": 0,
+            # "shopSku": "string",
+        }
+        for code, value in zip(remnants["Код"].tolist(), remnants["price_int"].tolist())
+    ]
+
+
+async def upload_prices(watch_remnants, offer_ids, campaign_id, market_token):
     """
     Получает список товаров магазина на Яндекс Маркете, которые есть на сайте timeworld.ru, с новыми значениями цен
     и обновляет цены товаров магазина на Яндекс Маркете.
 
     Args:
-        watch_remnants (list of dict): Список остатков товаров с сайта timeworld.ru.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru, подготовленная prepare_remnants.
+        offer_ids (list): Список артикулов товаров магазина на Яндекс Маркете.
         campaign_id (int): Идентификатор магазина на Яндекс маркете для работы с API.
         market_token (str): API-Key-токен с доступами к определенным группам API-методов Яндекс Маркета.
 
     Returns:
         list of dict: Список товаров с данными о цене.
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
-        update_price(some_prices, campaign_id, market_token)
+    await update_in_chunks(update_price, prices, 500, campaign_id, market_token, controller=_CONTROLLER)
     return prices
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(watch_remnants, offer_ids, campaign_id, market_token, warehouse_id, zeroed_dir=ZEROED_OFFERS_DIR):
     """
     Получает список всех товаров магазина на Яндекс Маркете с новыми значениями количества
     и обновляет остатки товаров магазина на Яндекс Маркете.
+    Количество = 0 для товаров, которых нет на сайте timeworld.ru, отправляется только тем,
+    кому оно не было записано при прошлом обновлении (см. load_zeroed_offers).
 
     Args:
-        watch_remnants (list of dict): Список остатков товаров с сайта timeworld.ru.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru, подготовленная prepare_remnants.
+        offer_ids (list): Список артикулов товаров магазина на Яндекс Маркете.
         campaign_id (int): Идентификатор магазина на Яндекс маркете для работы с API.
         market_token (str): API-Key-токен с доступами к определенным группам API-методов Яндекс Маркета.
         warehouse_id (int): Идентификатор склада на Яндекс маркете.
+        zeroed_dir (str): Каталог с файлами артикулов, которым записано количество = 0.
 
     Returns:
         not_empty (list of dict): Список товаров, количество которых больше 0, с данными о количестве.
         stocks (list of dict): Список товаров с данными о количестве.
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
-    stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
-        update_stocks(some_stock, campaign_id, market_token)
-    not_empty = list(
-        filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks)
-    )
+    key = f"yandex_{campaign_id}_{warehouse_id}"
+    zeroed = load_zeroed_offers(key, zeroed_dir)
+    stocks = create_stocks(watch_remnants, offer_ids, warehouse_id, zeroed)
+    await update_in_chunks(update_stocks, stocks, 2000, campaign_id, market_token, controller=_CONTROLLER)
+    save_zeroed_offers(key, set(offer_ids).difference(watch_remnants["Код"]), zeroed_dir)
+    not_empty = [stock for stock in stocks if stock["items"][0]["count"] != 0]
     return not_empty, stocks
 
 
-def main():
+async def sync_campaign(watch_remnants, campaign_id, market_token, warehouse_id, zeroed_dir=ZEROED_OFFERS_DIR):
+    """
+    Обновляет остатки и цены товаров одного магазина (FBS или DBS) на Яндекс Маркете.
+
+    Args:
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru, подготовленная prepare_remnants.
+        campaign_id (int): Идентификатор магазина на Яндекс маркете для работы с API.
+        market_token (str): API-Key-токен с доступами к определенным группам API-методов Яндекс Маркета.
+        warehouse_id (int): Идентификатор склада на Яндекс маркете.
+        zeroed_dir (str): Каталог с файлами артикулов, которым записано количество = 0.
+
+    Examples:
+        correct execution:
+            >>> asyncio.run(sync_campaign(prepare_remnants(download_stock()), 123456, "y0_BfRRRRRV2L8sWWvNkSNNNNSrLHaNXg4cCMswFbL6MWab9lktL2KPsMw", 1))
+
+        incorrect execution:
+            >>> asyncio.run(sync_campaign(prepare_remnants(download_stock()), 123456, "", 1))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
+    """
+    offer_ids = await get_offer_ids(campaign_id, market_token)
+    # Обновить остатки
+    await upload_stocks(watch_remnants, offer_ids, campaign_id, market_token, warehouse_id, zeroed_dir)
+    # Поменять цены
+    await upload_prices(watch_remnants, offer_ids, campaign_id, market_token)
+
+
+async def main():
     env = Env()
     market_token = env.str("MARKET_TOKEN")
     campaign_fbs_id = env.str("FBS_ID")
     campaign_dbs_id = env.str("DBS_ID")
     warehouse_fbs_id = env.str("WAREHOUSE_FBS_ID")
     warehouse_dbs_id = env.str("WAREHOUSE_DBS_ID")
+    zeroed_dir = env.str("ZEROED_OFFERS_DIR", ZEROED_OFFERS_DIR)
 
-    watch_remnants = download_stock()
+    watch_remnants = prepare_remnants(await asyncio.to_thread(download_stock))
     try:
-        # FBS
-        offer_ids = get_offer_ids(campaign_fbs_id, market_token)
-        # Обновить остатки FBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
-        # Поменять цены FBS
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
-
-        # DBS
-        offer_ids = get_offer_ids(campaign_dbs_id, market_token)
-        # Обновить остатки DBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
-        # Поменять цены DBS
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
-    except requests.exceptions.ReadTimeout:
-        print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
-        print(error, "Ошибка соединения")
-    except Exception as error:
-        print(error, "ERROR_2")
+        # FBS и DBS обновляются одновременно, ошибка одного не прерывает другой
+        results = await asyncio.gather(
+            sync_campaign(watch_remnants, campaign_fbs_id, market_token, warehouse_fbs_id, zeroed_dir),
+            sync_campaign(watch_remnants, campaign_dbs_id, market_token, warehouse_dbs_id, zeroed_dir),
+            return_exceptions=True,
+        )
+        for scheme, result in zip(("FBS", "DBS"), results):
+            if isinstance(result, httpx.ReadTimeout):
+                print(scheme, "Превышено время ожидания...")
+            elif isinstance(result, httpx.ConnectError):
+                print(scheme, result, "Ошибка соединения")
+            elif isinstance(result, BaseException):
+                print(scheme, result, "ERROR_2")
+    finally:
+        # Клиент закрывается только после завершения обоих магазинов
+        await _CLIENT.aclose()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
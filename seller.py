@@ -1,17 +1,349 @@
+import asyncio
+import datetime
+import email.utils
+import functools
 import io
+import itertools
 import logging.config
+import math
 import os
+import random
 import re
+import tempfile
+import time
+import weakref
 import zipfile
+from collections.abc import Iterable
 from environs import Env
 
+import httpx
+import numpy as np
+import orjson
 import pandas as pd
-import requests
 
 logger = logging.getLogger(__file__)
 
+# Таймауты запросов к API: большие пакеты остатков и цен обрабатываются долго
+API_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+# Таймаут скачивания архива с остатками с сайта timeworld.ru
+DOWNLOAD_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+# Коды ответов, при которых запрос повторяется
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# Макс. пауза в секундах по заголовку Retry-After
+MAX_RETRY_AFTER = 120.0
+# Все, кроме цифр, в строке с ценой
+_PRICE_RE = re.compile(r"[^0-9]")
+# Каталог с артикулами, которым уже записано количество = 0 (по файлу на магазин и склад)
+ZEROED_OFFERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zeroed_offers")
+# Срок в секундах, после которого количество = 0 снова отправляется всем таким артикулам
+ZEROED_OFFERS_TTL = 24 * 3600
+# Все, кроме безопасных для имени файла символов, в ключе магазина
+_ZEROED_KEY_RE = re.compile(r"[^0-9A-Za-z_-]")
+
+
+class ConcurrencyController:
+    """
+    Регулирует количество одновременных запросов к API по схеме AIMD:
+    после каждой попытки запроса не дольше latency_target лимит растет на alpha,
+    при ответах с кодами из RETRY_STATUSES и ошибках соединения - умножается на beta.
+    Если сервер прислал Retry-After или в X-RateLimit-Remaining осталось меньше
+    remaining_share от X-RateLimit-Limit, новые запросы приостанавливаются.
+    Лимит общий для всех вызовов update_in_chunks с этим регулятором.
+
+    Args:
+        c (float): Начальное количество одновременных запросов.
+        c_min (int): Мин. количество одновременных запросов.
+        c_max (int): Макс. количество одновременных запросов.
+        alpha (float): Прибавка к лимиту после быстрого успешного ответа.
+        beta (float): Множитель лимита при перегрузке.
+        latency_target (float): Допустимое время ответа на одну попытку запроса в секундах.
+        remaining_share (float): Доля оставшегося лимита запросов, при которой нужна пауза.
+        pause (float): Пауза в секундах при исчерпании лимита, если сервер не прислал Retry-After.
+
+    Examples:
+        correct execution:
+            >>> controller = ConcurrencyController(c=2)
+            >>> controller.on_success(0.2)
+            >>> print(controller.limit)
+            2
+
+        incorrect execution:
+            >>> controller = ConcurrencyController(c=2)
+            >>> controller.on_success("0.2")
+            TypeError: '<=' not supported between instances of 'str' and 'float'
+    """
+
+    def __init__(
+        self,
+        c=8,
+        c_min=1,
+        c_max=16,
+        alpha=0.5,
+        beta=0.5,
+        latency_target=1.0,
+        remaining_share=0.1,
+        pause=1.0,
+    ):
+        self.c = c
+        self.c_min = c_min
+        self.c_max = c_max
+        self.alpha = alpha
+        self.beta = beta
+        self.latency_target = latency_target
+        self.remaining_share = remaining_share
+        self.pause = pause
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self._slot_freed = None
+        self._started = weakref.WeakKeyDictionary()
+
+    @property
+    def limit(self):
+        """int: Текущее допустимое количество одновременных запросов."""
+        return max(self.c_min, int(self.c))
+
+    def on_success(self, latency):
+        """Учитывает успешную попытку запроса, выполненную за latency секунд: быстрая увеличивает лимит."""
+        if latency <= self.latency_target:
+            self.c = min(self.c_max, self.c + self.alpha)
+
+    def on_overload(self):
+        """Уменьшает лимит при ответе из RETRY_STATUSES или ошибке соединения."""
+        self.c = max(self.c_min, self.c * self.beta)
+
+    def pause_for(self, delay):
+        """Приостанавливает новые запросы на delay секунд."""
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    async def on_request(self, request):
+        """
+        Хук httpx на каждую попытку запроса: запоминает время отправки.
+
+        Args:
+            request (httpx.Request): Запрос к API.
+        """
+        self._started[request] = time.monotonic()
+
+    async def observe(self, response):
+        """
+        Хук httpx на каждый ответ: учитывает код и время ответа на эту попытку
+        и заголовки Retry-After, X-RateLimit-*.
+
+        Args:
+            response (httpx.Response): Ответ API.
+        """
+        started = self._started.pop(response.request, None)
+        if response.status_code in RETRY_STATUSES:
+            self.on_overload()
+        elif response.is_success and started is not None:
+            self.on_success(time.monotonic() - started)
+        delay = parse_retry_after(response.headers.get("Retry-After"))
+        remaining = response.headers.get("X-RateLimit-Remaining", "")
+        limit = response.headers.get("X-RateLimit-Limit", "")
+        if remaining.isdigit() and limit.isdigit():
+            if int(remaining) < self.remaining_share * int(limit):
+                delay = max(delay, self.pause)
+        if delay:
+            self.pause_for(delay)
+
+    async def wait(self):
+        """Ждет окончания паузы, если она была назначена."""
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def acquire(self):
+        """Ждет окончания паузы и свободного места среди одновременных запросов и занимает его."""
+        if self._slot_freed is None:
+            self._slot_freed = asyncio.Event()
+        # Пауза могла быть назначена, пока ждали места, поэтому оба условия проверяются после каждого ожидания
+        while True:
+            await self.wait()
+            if self.in_flight < self.limit:
+                break
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+        self.in_flight += 1
+
+    def release(self):
+        """Освобождает место, занятое acquire."""
+        self.in_flight -= 1
+        if self._slot_freed is not None:
+            self._slot_freed.set()
+
+
+class ObservedTransport(httpx.AsyncBaseTransport):
+    """
+    Транспорт httpx, сообщающий регулятору об ошибке соединения на каждой попытке запроса,
+    в том числе при чтении тела ответа. Коды и время ответов учитываются хуками
+    on_request и observe регулятора.
+
+    Args:
+        controller (ConcurrencyController): Регулятор количества одновременных запросов.
+        **kwargs: Параметры httpx.AsyncHTTPTransport (http2, limits и т.д.).
+
+    Examples:
+        correct execution:
+            >>> client = httpx.AsyncClient(transport=ObservedTransport(ConcurrencyController(), http2=True))
+
+        incorrect execution:
+            >>> ObservedTransport(ConcurrencyController(), http3=True)
+            TypeError: AsyncHTTPTransport.__init__() got an unexpected keyword argument 'http3'
+    """
+
+    def __init__(self, controller, **kwargs):
+        self.controller = controller
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+
+    async def handle_async_request(self, request):
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.TransportError:
+            self.controller.on_overload()
+            raise
+        response.stream = _ObservedStream(response.stream, self.controller)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class _ObservedStream(httpx.AsyncByteStream):
+    """Тело ответа, сообщающее регулятору об ошибке соединения при чтении."""
+
+    def __init__(self, stream, controller):
+        self._stream = stream
+        self._controller = controller
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        except httpx.TransportError:
+            self._controller.on_overload()
+            raise
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+
+_CONTROLLER = ConcurrencyController()
+
+_CLIENT = httpx.AsyncClient(
+    base_url="https://api-seller.ozon.ru",
+    transport=ObservedTransport(
+        _CONTROLLER,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+    ),
+    timeout=API_TIMEOUT,
+    headers={"Content-Type": "application/json"},
+    event_hooks={"request": [_CONTROLLER.on_request], "response": [_CONTROLLER.observe]},
+)
+
+
+def parse_retry_after(value, max_delay=MAX_RETRY_AFTER):
+    """
+    Переводит значение заголовка Retry-After в количество секунд ожидания.
+
+    Args:
+        value (str): Значение заголовка: число секунд или HTTP-дата.
+        max_delay (float): Макс. количество секунд ожидания.
+
+    Returns:
+        float: Количество секунд ожидания, не больше max_delay
+            (0, если заголовка нет или его не удалось разобрать).
 
-def get_product_list(last_id, client_id, seller_token):
+    Examples:
+        correct execution:
+            >>> print(parse_retry_after("3"))
+            3.0
+
+            >>> print(parse_retry_after("86400"))
+            120.0
+
+        incorrect execution:
+            >>> print(parse_retry_after("soon"))
+            0
+    """
+    if not value:
+        return 0
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return 0
+        if retry_at.tzinfo is None:
+            # Дата с зоной "-0000" разбирается без часового пояса, по RFC 2822 это UTC
+            retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+        delay = (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    if not math.isfinite(delay):
+        return 0
+    return min(max_delay, max(0.0, delay))
+
+
+def retry_with_backoff(base=0.5, cap=30, max_attempts=7):
+    """
+    Повторяет запрос к API при ошибках соединения и ответах с кодами из RETRY_STATUSES.
+
+    Пауза перед n-й повторной попыткой = min(cap, base * 2**n) + случайная добавка от 0 до base,
+    но не меньше значения заголовка Retry-After, если сервер его прислал.
+    Декоратор применяется к функциям, отправляющим один запрос (get_product_list, update_price, update_stocks).
+    Уже обернутые функции повторно не оборачиваются, иначе количество попыток перемножается.
+
+    Args:
+        base (float): Начальная пауза в секундах.
+        cap (float): Макс. пауза в секундах без учета Retry-After.
+        max_attempts (int): Макс. количество попыток.
+
+    Returns:
+        function: Декоратор для асинхронных функций, обращающихся к API.
+
+    Examples:
+        correct execution:
+            >>> @retry_with_backoff(max_attempts=3)
+            ... async def get_warehouses(client_id, seller_token):
+            ...     headers = {"Client-Id": client_id, "Api-Key": seller_token}
+            ...     response = await _CLIENT.post("/v1/warehouse/list", content=b"{}", headers=headers)
+            ...     response.raise_for_status()
+            ...     return orjson.loads(response.content)
+            >>> print(asyncio.run(get_warehouses("123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72")))
+            {"result": [{"warehouse_id": 15588127982000, "name": "Склад"}]}
+
+        incorrect execution:
+            >>> print(asyncio.run(get_warehouses("123456", "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    return await func(*args, **kwargs)
+                except httpx.HTTPStatusError as error:
+                    if error.response.status_code not in RETRY_STATUSES or attempt == max_attempts:
+                        raise
+                    retry_after = parse_retry_after(error.response.headers.get("Retry-After"))
+                except httpx.TransportError:
+                    if attempt == max_attempts:
+                        raise
+                    retry_after = 0
+                delay = max(retry_after, min(cap, base * 2 ** (attempt - 1)) + random.uniform(0, base))
+                logger.warning(
+                    "%s: попытка %s из %s не удалась, повтор через %.1f с",
+                    func.__name__, attempt, max_attempts, delay,
+                )
+                await asyncio.sleep(delay)
+
+        return wrapper
+
+    return decorator
+
+
+@retry_with_backoff(base=0.5, cap=30, max_attempts=7)
+async def get_product_list(last_id, client_id, seller_token):
     """
     Получает список всех товаров продавца на озон.
 
@@ -29,7 +361,7 @@ def get_product_list(last_id, client_id, seller_token):
 
     Examples:
         correct execution:
-            >>> print(get_product_list("", "123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72"))
+            >>> print(asyncio.run(get_product_list("", "123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72")))
             {
                 "items": [
                     {
@@ -52,10 +384,10 @@ def get_product_list(last_id, client_id, seller_token):
             }
 
         incorrect execution:
-            >>> print(get_product_list("", "123456", ""))
-            requests.exceptions.HTTPError: 401 Client Error
+            >>> print(asyncio.run(get_product_list("", "123456", "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
     """
-    url = "https://api-seller.ozon.ru/v2/product/list"
+    url = "/v2/product/list"
     headers = {
         "Client-Id": client_id,
         "Api-Key": seller_token,
@@ -67,13 +399,13 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = await _CLIENT.post(url, content=orjson.dumps(payload), headers=headers)
     response.raise_for_status()
-    response_object = response.json()
+    response_object = orjson.loads(response.content)
     return response_object.get("result")
 
 
-def get_offer_ids(client_id, seller_token):
+async def get_offer_ids(client_id, seller_token):
     """
     Получает артикулы всех товаров продавца на озон.
 
@@ -86,29 +418,28 @@ def get_offer_ids(client_id, seller_token):
 
     Examples:
         correct execution:
-            >>> print(get_offer_ids("123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72"))
+            >>> print(asyncio.run(get_offer_ids("123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72")))
             ['136748', '136749']
 
         incorrect execution:
-            >>> print(get_offer_ids("123456", ""))
-            requests.exceptions.HTTPError: 401 Client Error
+            >>> print(asyncio.run(get_offer_ids("123456", "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
     """
     last_id = ""
-    product_list = []
+    offer_ids = []
     while True:
-        some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
-        total = some_prod.get("total")
+        some_prod = await get_product_list(last_id, client_id, seller_token)
+        items = some_prod.get("items")
+        offer_ids.extend(product.get("offer_id") for product in items)
         last_id = some_prod.get("last_id")
-        if total == len(product_list):
+        # Каталог может уменьшиться во время обхода, а пустой last_id вернул бы обход на первую страницу
+        if not items or not last_id or len(offer_ids) >= some_prod.get("total"):
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer_id"))
     return offer_ids
 
 
-def update_price(prices: list, client_id, seller_token):
+@retry_with_backoff(base=0.5, cap=30, max_attempts=7)
+async def update_price(prices: list, client_id, seller_token):
     """
     Обновляет цены товаров продавца на озон.
 
@@ -122,7 +453,7 @@ def update_price(prices: list, client_id, seller_token):
 
     Examples:
         correct execution:
-            >>> print(update_price([],"123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72"))
+            >>> print(asyncio.run(update_price([],"123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72")))
             {
                 "result": [
                     {
@@ -135,21 +466,22 @@ def update_price(prices: list, client_id, seller_token):
             }
 
         incorrect execution:
-            >>> print(update_price([], "123456", ""))
-            requests.exceptions.HTTPError: 401 Client Error
+            >>> print(asyncio.run(update_price([], "123456", "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
     """
-    url = "https://api-seller.ozon.ru/v1/product/import/prices"
+    url = "/v1/product/import/prices"
     headers = {
         "Client-Id": client_id,
         "Api-Key": seller_token,
     }
     payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
+    response = await _CLIENT.post(url, content=orjson.dumps(payload), headers=headers)
     response.raise_for_status()
-    return response.json()
+    return orjson.loads(response.content)
 
 
-def update_stocks(stocks: list, client_id, seller_token):
+@retry_with_backoff(base=0.5, cap=30, max_attempts=7)
+async def update_stocks(stocks: list, client_id, seller_token):
     """
     Обновляет остатки товаров продавца на озон.
 
@@ -163,7 +495,7 @@ def update_stocks(stocks: list, client_id, seller_token):
 
     Examples:
     correct execution:
-            >>> print(update_stocks([],"123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72"))
+            >>> print(asyncio.run(update_stocks([],"123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72")))
             {
                 "result": [
                     {
@@ -177,18 +509,18 @@ def update_stocks(stocks: list, client_id, seller_token):
             }
 
         incorrect execution:
-            >>> print(update_stocks([], "123456", ""))
-            requests.exceptions.HTTPError: 401 Client Error
+            >>> print(asyncio.run(update_stocks([], "123456", "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
     """
-    url = "https://api-seller.ozon.ru/v1/product/import/stocks"
+    url = "/v1/product/import/stocks"
     headers = {
         "Client-Id": client_id,
         "Api-Key": seller_token,
     }
     payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
+    response = await _CLIENT.post(url, content=orjson.dumps(payload), headers=headers)
     response.raise_for_status()
-    return response.json()
+    return orjson.loads(response.content)
 
 
 def download_stock():
@@ -196,85 +528,76 @@ def download_stock():
     Получает остатки товаров с сайта timeworld.ru.
 
     Returns:
-        list of dict: Список товаров со следующими полями: Код, Наименование товара, Изображение, Цена, Количество, Заказ.
+        pandas.DataFrame: Таблица товаров со строковыми столбцами: Код, Количество, Цена.
 
     Examples:
         correct execution:
             >>> print(download_stock())
-            [
-                {
-                    'Код': 69791,
-                    'Наименование товара': 'Украшение для дисплеев 219RU-GSGSTDUMMY2',
-                    'Изображение': 'Показать',
-                    'Цена': '550.00 руб.',
-                    'Количество': '>10',
-                    'Заказ': ''
-                },
-                ...и т.д.
-            ]
+                     Код Количество         Цена
+            0      69791        >10  550.00 руб.
+            ...и т.д.
         incorrect execution:
             >>> print(download_stock())
-            requests.exceptions.HTTPError: 403 Client Error
+            httpx.HTTPStatusError: Client error '403 Forbidden'
     """
     # Скачать остатки с сайта
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
-    session = requests.Session()
-    response = session.get(casio_url)
+    response = httpx.get(casio_url, follow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
     response.raise_for_status()
-    with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
-    watch_remnants = pd.read_excel(
-        io=excel_file,
-        na_values=None,
-        keep_default_na=False,
-        header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+    # Создаем список остатков часов, читая файл прямо из архива в памяти:
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        with archive.open("ostatki.xls") as excel_file:
+            watch_remnants = pd.read_excel(
+                io=excel_file,
+                engine="xlrd",
+                usecols=["Код", "Количество", "Цена"],
+                dtype={"Код": str, "Количество": str, "Цена": str},
+                na_values=None,
+                keep_default_na=False,
+                header=17,
+            )
     return watch_remnants
 
 
-def create_stocks(watch_remnants, offer_ids):
+def create_stocks(watch_remnants, offer_ids, zeroed=frozenset()):
     """
     Формирует список всех товаров продавца на озон с новыми значениями количества, а именно:
     если товар с сайта timeworld.ru есть у продавца на озон, то количество записывается по условиям:
         если на сайте = ">10", то = 100,
         если на сайте = "1", то = 0,
         иначе, то = количество с сайта.
-    Для товаров продавца на озон, которых нет на сайте timeworld.ru, записывается количество = 0.
+    Для товаров продавца на озон, которых нет на сайте timeworld.ru, записывается количество = 0,
+    кроме тех, кому оно уже было записано (zeroed). Расчет на то, что озон не меняет остатки товаров,
+    которых нет в запросе; на случай ручных правок все нули повторяются раз в ZEROED_OFFERS_TTL.
 
     Args:
-        watch_remnants (list of dict): Список остатков товаров с сайта timeworld.ru.
-        offer_ids (list): Список артикулов товаров продавца на озон.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru, подготовленная prepare_remnants.
+        offer_ids (list): Список артикулов товаров продавца на озон, сам список не изменяется.
+        zeroed (set): Артикулы, которым количество = 0 уже записано при прошлом обновлении.
 
     Returns:
         list of dict: Список товаров с данными о количестве.
 
     Examples:
         correct execution:
-            >>> print(create_stocks([{'Код': 69791, 'Количество': '>10'}], ['69791', '70000']))
+            >>> print(create_stocks(prepare_remnants(pd.DataFrame([{'Код': 69791, 'Количество': '>10', 'Цена': '550.00 руб.'}])), ['69791', '70000']))
             [{'offer_id': '69791', 'stock': 100}, {'offer_id': '70000', 'stock': 0}]
 
         incorrect execution:
             >>> print(create_stocks({'Код': 69791, 'Количество': '>10'}, ['69791', '70000']))
-            AttributeError: 'str' object has no attribute 'get'
+            AttributeError: 'int' object has no attribute 'isin'
     """
     # Уберем то, что не загружено в seller
-    stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
-    # Добавим недостающее из загруженного:
+    remnants = watch_remnants[watch_remnants["Код"].isin(offer_ids)].drop_duplicates("Код")
+    stocks = [
+        {"offer_id": code, "stock": stock}
+        for code, stock in zip(remnants["Код"].tolist(), remnants["stock"].tolist())
+    ]
+    # Добавим недостающее из загруженного, сохраняя порядок offer_ids:
+    skipped = set(remnants["Код"]).union(zeroed)
     for offer_id in offer_ids:
+        if offer_id in skipped:
+            continue
         stocks.append({"offer_id": offer_id, "stock": 0})
     return stocks
 
@@ -284,65 +607,126 @@ def create_prices(watch_remnants, offer_ids):
     Формирует список товаров продавца на озон, которые есть на сайте timeworld.ru, с новыми значениями цен.
 
     Args:
-        watch_remnants (list of dict): Список остатков товаров с сайта timeworld.ru.
-        offer_ids (list): Список артикулов товаров продавца на озон.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru, подготовленная prepare_remnants.
+        offer_ids (list): Список артикулов товаров продавца на озон, сам список не изменяется.
 
     Returns:
         list of dict: Список товаров с данными о цене.
     Examples:
         correct execution:
-                >>> print(create_prices([{'Код': 69791, 'Цена': '550.00 руб.'}], ['69791', '70000']))
+                >>> print(create_prices(prepare_remnants(pd.DataFrame([{'Код': 69791, 'Количество': '>10', 'Цена': '550.00 руб.'}])), ['69791', '70000']))
                 [{'auto_action_enabled': 'UNKNOWN', 'currency_code': 'RUB', 'offer_id': '69791', 'old_price': '0', 'price': '550'}]
 
         incorrect execution:
             >>> print(create_prices({'Код': 69791, 'Количество': '>10'}, ['69791', '70000']))
-            AttributeError: 'str' object has no attribute 'get'
-    """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
-    return prices
+            AttributeError: 'int' object has no attribute 'isin'
+    """
+    remnants = watch_remnants[watch_remnants["Код"].isin(offer_ids)]
+    return [
+        {
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "offer_id": code,
+            "old_price": "0",
+            "price": price,
+        }
+        for code, price in zip(remnants["Код"].tolist(), remnants["price"].tolist())
+    ]
+
+
+def prepare_remnants(watch_remnants):
+    """
+    Один раз готовит таблицу остатков для всех магазинов: приводит коды к строкам
+    и вычисляет столбцы stock (остаток по правилам stocks_conversion), price (цена по правилам prices_conversion)
+    и price_int (та же цена целым числом, пусто, если цифр в цене нет).
+
+    Args:
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru.
+
+    Returns:
+        pandas.DataFrame: Таблица со столбцами Код, stock, price, price_int.
 
+    Examples:
+        correct execution:
+            >>> print(prepare_remnants(pd.DataFrame([{'Код': 69791, 'Количество': '>10', 'Цена': '550.00 руб.'}])))
+                 Код  stock price  price_int
+            0  69791    100   550        550
 
-def price_conversion(price: str) -> str:
+        incorrect execution:
+            >>> print(prepare_remnants(pd.DataFrame([{'Код': 69791, 'Количество': '>10'}])))
+            KeyError: 'Цена'
+    """
+    prices = prices_conversion(watch_remnants["Цена"])
+    return pd.DataFrame(
+        {
+            "Код": watch_remnants["Код"].astype(str),
+            "stock": stocks_conversion(watch_remnants["Количество"]),
+            "price": prices,
+            "price_int": pd.to_numeric(prices, errors="coerce").astype("Int64"),
+        }
+    )
+
+
+def stocks_conversion(counts: pd.Series) -> pd.Series:
     """
-    Оставляет в строке с ценой только цифры без дробной части после точки.
+    Переводит столбец количества с сайта timeworld.ru в остатки:
+    ">10" - в 100, "1" - в 0, остальное - в целое число (нечисловые значения - в 0).
 
     Args:
-        price (str): Строка с ценой.
+        counts (pandas.Series): Столбец количества с сайта.
 
     Returns:
-        str: Строка из целого числа.
+        pandas.Series: Столбец остатков.
 
     Examples:
         correct execution:
-            >>> print(price_conversion("5'990.00 руб."))
-            5990
+            >>> print(stocks_conversion(pd.Series([">10", "1", "5"])).tolist())
+            [100, 0, 5]
 
         incorrect execution:
-            >>> print(price_conversion("5'990,00 руб."))
-            599000
+            >>> print(stocks_conversion([">10", "1", "5"]))
+            AttributeError: 'list' object has no attribute 'astype'
+    """
+    counts = counts.astype(str)
+    stocks = np.select(
+        [counts == ">10", counts == "1"],
+        [100, 0],
+        default=pd.to_numeric(counts, errors="coerce").fillna(0).astype(int),
+    )
+    return pd.Series(stocks, index=counts.index)
+
 
-            >>> print(price_conversion(5990.00))
-            AttributeError: 'float' object has no attribute 'split'
+def prices_conversion(prices: pd.Series) -> pd.Series:
     """
-    return re.sub("[^0-9]", "", price.split(".")[0])
+    Оставляет в каждой строке столбца цен только цифры без дробной части после точки.
 
+    Args:
+        prices (pandas.Series): Столбец строк с ценами.
+
+    Returns:
+        pandas.Series: Столбец строк из целых чисел.
+
+    Examples:
+        correct execution:
+            >>> print(prices_conversion(pd.Series(["5'990.00 руб.", "550.00 руб."])).tolist())
+            ['5990', '550']
+
+        incorrect execution:
+            >>> print(prices_conversion(pd.Series(["5'990,00 руб."])).tolist())
+            ['599000']
 
-def divide(lst: list, n: int):
+            >>> print(prices_conversion(["5'990.00 руб."]))
+            AttributeError: 'list' object has no attribute 'astype'
     """
-    Делит список lst на части по n элементов
+    return prices.astype(str).str.split(".", n=1).str[0].str.replace(_PRICE_RE, "", regex=True)
+
+
+def divide(lst: Iterable, n: int):
+    """
+    Делит список lst на части по n элементов, не копируя его целиком
 
     Args:
-        lst (list): Любой список.
+        lst (iterable): Любой список или другой итерируемый объект, в том числе генератор.
         n (int): Макс. количество элементов списка в одной части.
 
     Yields:
@@ -354,20 +738,197 @@ def divide(lst: list, n: int):
             [[1, 2, 3, 4, 5], [6, 7, 8, 9, 10], [11, 12]]
 
         incorrect execution:
-            >>> print([i for i in divide({'Код': 69791, 'Количество': '>10', 'Цена': 250}, 2)])
-            KeyError: slice(0, 2, None)
+            >>> print([i for i in divide(69791, 2)])
+            TypeError: 'int' object is not iterable
     """
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
+    iterator = iter(lst)
+    while part := list(itertools.islice(iterator, n)):
+        yield part
 
 
-async def upload_prices(watch_remnants, client_id, seller_token):
+def zeroed_offers_path(key, directory=ZEROED_OFFERS_DIR):
+    """
+    Возвращает путь к файлу с артикулами, которым записано количество = 0, для магазина.
+
+    Args:
+        key (str): Ключ магазина с префиксом маркетплейса, например "ozon_123456" или "yandex_123456_789".
+        directory (str): Каталог с файлами артикулов.
+
+    Returns:
+        str: Абсолютный путь к файлу магазина.
+
+    Examples:
+        correct execution:
+            >>> print(zeroed_offers_path("ozon_123456", "/var/lib/seller"))
+            /var/lib/seller/ozon_123456.json
+
+        incorrect execution:
+            >>> print(zeroed_offers_path(None))
+            TypeError: expected string or bytes-like object, got 'NoneType'
+    """
+    return os.path.join(os.path.abspath(directory), f"{_ZEROED_KEY_RE.sub('_', key)}.json")
+
+
+def _read_zeroed_offers(path):
+    """
+    Читает файл с артикулами, которым записано количество = 0.
+    Файл только ускоряет обновление, поэтому нечитаемый или поврежденный файл
+    считается пустым (с предупреждением в журнале), а не прерывает обновление остатков.
+
+    Args:
+        path (str): Путь к файлу магазина.
+
+    Returns:
+        dict: Срок записи - "expires_at" и артикулы - "offer_ids" (пустой словарь, если файла нет или он поврежден).
+    """
+    try:
+        with open(path, "rb") as file:
+            zeroed_offers = orjson.loads(file.read())
+    except FileNotFoundError:
+        return {}
+    except (OSError, orjson.JSONDecodeError) as error:
+        logger.warning("%s: файл не прочитан и считается пустым: %s", path, error)
+        return {}
+    expires_at = zeroed_offers.get("expires_at") if isinstance(zeroed_offers, dict) else None
+    offer_ids = zeroed_offers.get("offer_ids") if isinstance(zeroed_offers, dict) else None
+    if (
+        not isinstance(expires_at, (int, float))
+        or isinstance(expires_at, bool)
+        or not isinstance(offer_ids, list)
+        or not all(isinstance(offer_id, str) for offer_id in offer_ids)
+    ):
+        logger.warning("%s: неверный формат файла, файл считается пустым", path)
+        return {}
+    return zeroed_offers
+
+
+def load_zeroed_offers(key, directory=ZEROED_OFFERS_DIR):
+    """
+    Читает артикулы, которым при прошлом обновлении было записано количество = 0 из-за отсутствия на сайте timeworld.ru.
+    После истечения срока записи (ZEROED_OFFERS_TTL) возвращается пустое множество,
+    чтобы количество = 0 снова было отправлено всем таким артикулам.
+
+    Args:
+        key (str): Ключ магазина с префиксом маркетплейса, например "ozon_123456" или "yandex_123456_789".
+        directory (str): Каталог с файлами артикулов.
+
+    Returns:
+        set: Артикулы магазина (пустое множество, если файла нет, он поврежден или срок записи истек).
+
+    Examples:
+        correct execution:
+            >>> print(load_zeroed_offers("ozon_123456"))
+            {'70000'}
+
+        incorrect execution:
+            >>> print(load_zeroed_offers("ozon_123456", directory="/etc/passwd"))
+            /etc/passwd/ozon_123456.json: файл не прочитан и считается пустым: [Errno 20] Not a directory: '/etc/passwd/ozon_123456.json'
+            set()
+    """
+    zeroed_offers = _read_zeroed_offers(zeroed_offers_path(key, directory))
+    if zeroed_offers.get("expires_at", 0) <= time.time():
+        return set()
+    return set(zeroed_offers["offer_ids"])
+
+
+def save_zeroed_offers(key, offer_ids, directory=ZEROED_OFFERS_DIR, ttl=ZEROED_OFFERS_TTL):
+    """
+    Сохраняет артикулы, которым записано количество = 0 из-за отсутствия на сайте timeworld.ru.
+    Срок действующей записи сохраняется, новый отсчитывается от текущего момента.
+
+    Args:
+        key (str): Ключ магазина с префиксом маркетплейса, например "ozon_123456" или "yandex_123456_789".
+        offer_ids (set): Артикулы магазина с количеством = 0.
+        directory (str): Каталог с файлами артикулов.
+        ttl (float): Срок записи в секундах.
+
+    Examples:
+        correct execution:
+            >>> save_zeroed_offers("ozon_123456", {"70000"})
+
+        incorrect execution:
+            >>> save_zeroed_offers("ozon_123456", {"70000"}, directory="/etc/passwd")
+            FileExistsError: [Errno 17] File exists: '/etc/passwd'
+    """
+    path = zeroed_offers_path(key, directory)
+    now = time.time()
+    expires_at = _read_zeroed_offers(path).get("expires_at", 0)
+    if expires_at <= now:
+        expires_at = now + ttl
+    zeroed_offers = {"expires_at": expires_at, "offer_ids": sorted(offer_ids)}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Пишем в собственный временный файл процесса и подменяем, чтобы не оставить файл недописанным
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as file:
+        file.write(orjson.dumps(zeroed_offers))
+    try:
+        os.replace(file.name, path)
+    except OSError:
+        os.unlink(file.name)
+        raise
+
+
+async def update_in_chunks(update, items, n, *args, controller=None):
+    """
+    Обновляет данные частями по n элементов, держа одновременно столько запросов,
+    сколько разрешает controller (с учетом других вызовов с тем же регулятором).
+    При ошибке одной из частей остальные не отправляются, а уже отправленные отменяются.
+
+    Args:
+        update (coroutine function): Функция обновления, принимающая часть списка и остальные аргументы *args.
+        items (list): Список для обновления.
+        n (int): Макс. количество элементов списка в одной части.
+        *args: Остальные аргументы функции update.
+        controller (ConcurrencyController): Регулятор количества одновременных запросов.
+            Если не указан, создается новый с параметрами по умолчанию.
+
+    Returns:
+        list: Ответы функции update для каждой части в порядке следования частей.
+
+    Examples:
+        correct execution:
+            >>> print(asyncio.run(update_in_chunks(update_stocks, [], 100, "123456", "82a02da882a02da882a02da8a981b7f3cc882a082a02da8e4af9c41e8551329276dde72")))
+            []
+
+        incorrect execution:
+            >>> print(asyncio.run(update_in_chunks(update_stocks, [{'offer_id': '69791', 'stock': 100}], 100, "123456", "")))
+            httpx.HTTPStatusError: Client error '401 Unauthorized'
+    """
+    if controller is None:
+        controller = ConcurrencyController()
+    tasks = []
+    failed = []
+
+    def on_done(task):
+        # Место освобождается и для задач, отмененных до запуска
+        controller.release()
+        if not task.cancelled() and task.exception() is not None:
+            failed.append(task)
+
+    try:
+        for part in divide(items, n):
+            if failed:
+                break
+            await controller.acquire()
+            if failed:
+                controller.release()
+                break
+            task = asyncio.create_task(update(part, *args))
+            task.add_done_callback(on_done)
+            tasks.append(task)
+        return list(await asyncio.gather(*tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def upload_prices(watch_remnants, offer_ids, client_id, seller_token):
     """
     Получает список товаров продавца на озон, которые есть на сайте timeworld.ru, с новыми значениями цен
     и обновляет цены товаров продавца на озон.
 
     Args:
-        watch_remnants (list of dict): Список остатков товаров с сайта timeworld.ru.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru, подготовленная prepare_remnants.
+        offer_ids (list): Список артикулов товаров продавца на озон.
         client_id (str): Идентификатор клиента-продавца озон.
         seller_token (str): Токен от АПИ продавца на озон.
 
@@ -375,57 +936,60 @@ async def upload_prices(watch_remnants, client_id, seller_token):
         list of dict: Список товаров с данными о цене.
 
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    await update_in_chunks(update_price, prices, 1000, client_id, seller_token, controller=_CONTROLLER)
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
+async def upload_stocks(watch_remnants, offer_ids, client_id, seller_token, zeroed_dir=ZEROED_OFFERS_DIR):
     """
     Получает список всех товаров продавца на озон с новыми значениями количества
     и обновляет остатки товаров продавца на озон.
+    Количество = 0 для товаров, которых нет на сайте timeworld.ru, отправляется только тем,
+    кому оно не было записано при прошлом обновлении (см. load_zeroed_offers).
 
     Args:
-        watch_remnants (list of dict): Список остатков товаров с сайта timeworld.ru.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта timeworld.ru, подготовленная prepare_remnants.
+        offer_ids (list): Список артикулов товаров продавца на озон.
         client_id (str): Идентификатор клиента-продавца озон.
         seller_token (str): Токен от АПИ продавца на озон.
+        zeroed_dir (str): Каталог с файлами артикулов, которым записано количество = 0.
 
     Returns:
         not_empty (list of dict): Список товаров, количество которых больше 0, с данными о количестве.
         stocks (list of dict): Список товаров с данными о количестве.
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
-    stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
-    not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
+    key = f"ozon_{client_id}"
+    zeroed = load_zeroed_offers(key, zeroed_dir)
+    stocks = create_stocks(watch_remnants, offer_ids, zeroed)
+    await update_in_chunks(update_stocks, stocks, 100, client_id, seller_token, controller=_CONTROLLER)
+    save_zeroed_offers(key, set(offer_ids).difference(watch_remnants["Код"]), zeroed_dir)
+    not_empty = [stock for stock in stocks if stock["stock"] != 0]
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
+    zeroed_dir = env.str("ZEROED_OFFERS_DIR", ZEROED_OFFERS_DIR)
     try:
-        offer_ids = get_offer_ids(client_id, seller_token)
-        watch_remnants = download_stock()
+        offer_ids = await get_offer_ids(client_id, seller_token)
+        watch_remnants = prepare_remnants(download_stock())
         # Обновить остатки
-        stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
+        await upload_stocks(watch_remnants, offer_ids, client_id, seller_token, zeroed_dir)
         # Поменять цены
         prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
-    except requests.exceptions.ReadTimeout:
+        await update_in_chunks(update_price, prices, 900, client_id, seller_token, controller=_CONTROLLER)
+    except httpx.ReadTimeout:
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except httpx.ConnectError as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
+    finally:
+        await _CLIENT.aclose()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())